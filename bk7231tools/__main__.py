@@ -473,6 +473,7 @@ def write_flash(device: BK7231Serial, args):
             start=args.start,
             crc_check=not args.no_verify_checksum,
             dry_run=False,
+            skip_if_match=args.skip_if_match,
         ):
             pass
 
@@ -562,6 +563,13 @@ def parse_args():
         default=False,
         help="Do not verify checksum of written flash segments - not recommended (default: False)",
     )
+    parser_write_flash.add_argument(
+        "--skip-if-match",
+        dest="skip_if_match",
+        action="store_true",
+        default=False,
+        help="Skip sectors whose flash contents already match the input data (default: False)",
+    )
     parser_write_flash.add_argument(
         "-B",
         "--bootloader",
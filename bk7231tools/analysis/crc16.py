@@ -1,19 +1,33 @@
 # https://stackoverflow.com/a/60604183
+def _crc16_table(poly: int) -> list:
+    table = []
+    for octet in range(256):
+        reg = octet << 8
+        for _ in range(8):
+            if reg & 0x8000:
+                reg = (reg << 1) ^ poly
+            else:
+                reg <<= 1
+        table.append(reg & 0xFFFF)
+    return table
+
+
+CRC16_TABLE = _crc16_table(0x8005)  # generator polinom (normal form)
+# the same table, followed by one more zero byte - for processing 2 bytes at once
+CRC16_TABLE_2 = [((reg << 8) & 0xFFFF) ^ CRC16_TABLE[reg >> 8] for reg in CRC16_TABLE]
+
+
 def crc16(data: bytes, initial_value: int = 0x0000) -> int:
     xor_in = initial_value  # initial value
     xor_out = 0x0000  # final XOR value
-    poly = 0x8005  # generator polinom (normal form)
+    table = CRC16_TABLE
+    table_2 = CRC16_TABLE_2
 
+    # process pairs of bytes using the precomputed tables
     reg = xor_in
-    for octet in data:
-        # reflect in
-        for i in range(8):
-            topbit = reg & 0x8000
-            if octet & (0x80 >> i):
-                topbit ^= 0x8000
-            reg <<= 1
-            if topbit:
-                reg ^= poly
-        reg &= 0xFFFF
-        # reflect out
+    odd = len(data) & 1
+    for hi, lo in zip(data[: len(data) - odd : 2], data[1::2]):
+        reg = table_2[(reg >> 8) ^ hi] ^ table[(reg & 0xFF) ^ lo]
+    if odd:
+        reg = ((reg << 8) & 0xFFFF) ^ table[(reg >> 8) ^ data[-1]]
     return reg ^ xor_out
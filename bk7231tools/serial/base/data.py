@@ -7,33 +7,105 @@ from serial import Serial
 from .enums import BkBootloader, BkBootloaderType, BkChipType, BkProtocolType
 
 
+def noop(*args) -> None:
+    pass
+
+
 class BK7231SerialData:
+    __slots__ = (
+        "serial",
+        "serial_fd",
+        "rx_buffer",
+        "baudrate",
+        "link_timeout",
+        "cmnd_timeout",
+        "protocol_type",
+        "chip_type",
+        "bootloader_type",
+        "bootloader",
+        "bootloader_crc",
+        "bk_chip_id",
+        "bk_boot_version",
+        "flash_params",
+        "flash_id",
+        "flash_size",
+        "flash_size_detected",
+        "flash_erase_checked",
+        "boot_protection_bypass",
+        "crc_speed_bps",
+        "cmnd_pipelining",
+        "read_retries",
+        "write_retries",
+        "warn",
+        "info",
+        "debug",
+        "verbose",
+    )
+
     serial: Serial
+    serial_fd: Optional[int]
+    rx_buffer: bytearray
     baudrate: int
     link_timeout: float
     cmnd_timeout: float
 
-    protocol_type: BkProtocolType = None
-    chip_type: Optional[BkChipType] = None
-    bootloader_type: Optional[BkBootloaderType] = None
-    bootloader: Optional[BkBootloader] = None
-    bk_chip_id: Optional[int] = None
-    bk_boot_version: Optional[str] = None
-
-    flash_params: dict = None
-    flash_id: bytes = None
-    flash_size: int = 0  # most appropriate known flash size
-    flash_size_detected: bool = False  # whether 'flash_size' was found by detection
-    flash_erase_checked: bool = False  # whether erase operation success was verified
-    boot_protection_bypass: bool = True  # whether BL protection bypass is enabled
-    crc_speed_bps: int = 400_000
-
-    # these parameters mean "retries", not "attempts"
-    read_retries: int = 20
-    # flash has limited lifespan so don't do too many retries
-    write_retries: int = 3
-
-    warn: Callable = print
-    info: Callable = lambda *args: None
-    debug: Callable = lambda *args: None
-    verbose: Callable = lambda *args: None
+    protocol_type: Optional[BkProtocolType]
+    chip_type: Optional[BkChipType]
+    bootloader_type: Optional[BkBootloaderType]
+    bootloader: Optional[BkBootloader]
+    bootloader_crc: Optional[int]
+    bk_chip_id: Optional[int]
+    bk_boot_version: Optional[str]
+
+    flash_params: Optional[dict]
+    flash_id: Optional[bytes]
+    flash_size: int
+    flash_size_detected: bool
+    flash_erase_checked: bool
+    boot_protection_bypass: bool
+    crc_speed_bps: int
+    cmnd_pipelining: bool
+
+    read_retries: int
+    write_retries: int
+
+    warn: Callable
+    info: Callable
+    debug: Callable
+    verbose: Callable
+
+    def __init__(self) -> None:
+        self.serial = None
+        self.serial_fd = None  # OS handle of the port, if available
+        self.rx_buffer = bytearray()  # data received but not consumed yet
+        self.baudrate = 115200
+        self.link_timeout = 10.0
+        self.cmnd_timeout = 1.0
+
+        self.protocol_type = None
+        self.chip_type = None
+        self.bootloader_type = None
+        self.bootloader = None
+        self.bootloader_crc = None  # CRC of first 256 bytes, read by detect_chip()
+        self.bk_chip_id = None
+        self.bk_boot_version = None
+
+        self.flash_params = None
+        self.flash_id = None
+        self.flash_size = 0  # most appropriate known flash size
+        self.flash_size_detected = False  # whether 'flash_size' was found by detection
+        self.flash_erase_checked = False  # whether erase operation success was verified
+        self.boot_protection_bypass = True  # whether BL protection bypass is enabled
+        self.crc_speed_bps = 400_000
+        self.cmnd_pipelining = True  # whether erase+write can be sent back-to-back
+
+        # these parameters mean "retries", not "attempts"
+        self.read_retries = 20
+        # flash has limited lifespan so don't do too many retries
+        self.write_retries = 3
+
+        self.warn = print
+        # 'self.info is noop' can be used to skip formatting messages
+        self.info = noop
+        self.debug = noop
+        self.verbose = noop
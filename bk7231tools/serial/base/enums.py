@@ -2,7 +2,7 @@
 
 from dataclasses import dataclass
 from enum import Enum, IntEnum
-from typing import Optional
+from typing import Dict, FrozenSet, Optional
 
 
 class BkChipType(IntEnum):
@@ -19,6 +19,10 @@ LONG = 1
 
 
 class BkProtocolType(Enum):
+    # opcodes supported by the protocol, filled in below
+    short_cmds: FrozenSet[int]
+    long_cmds: FrozenSet[int]
+
     # BK7231N BootROM protocol
     FULL = (
         (0x00, SHORT),  # CMD_LinkCheck
@@ -63,6 +67,14 @@ class BkProtocolType(Enum):
     )
 
 
+for _protocol in BkProtocolType:
+    _protocol.short_cmds = frozenset(
+        op for op, kind in _protocol.value if kind == SHORT
+    )
+    _protocol.long_cmds = frozenset(op for op, kind in _protocol.value if kind == LONG)
+del _protocol
+
+
 @dataclass
 class BkBootloader:
     # CRC-32 of first 256 bootloader bytes
@@ -164,7 +176,9 @@ class BkBootloaderType(Enum):
 
     @staticmethod
     def get_by_crc(crc: int) -> Optional["BkBootloaderType"]:
-        for item in BkBootloaderType:
-            if item.value.crc == crc:
-                return item
-        return None
+        return BOOTLOADER_BY_CRC.get(crc, None)
+
+
+BOOTLOADER_BY_CRC: Dict[int, BkBootloaderType] = {
+    item.value.crc: item for item in BkBootloaderType
+}
@@ -1,12 +1,15 @@
 #  Copyright (c) Kuba Szczodrzyński 2024-3-5.
 
-from typing import IO, Callable, Generator, Tuple, Type, Union
+from typing import IO, Callable, Generator, List, Tuple, Type, Union
 
 from .data import BK7231SerialData
+from .enums import BkProtocolType
 from .packets import EraseSize, Packet
 
 
 class BK7231SerialInterface(BK7231SerialData):
+    __slots__ = ()
+
     # legacy.py
     chip_info: str
 
@@ -30,6 +33,8 @@ class BK7231SerialInterface(BK7231SerialData):
 
     def detect_chip(self) -> None: ...
 
+    def detect_protocol(self) -> BkProtocolType: ...
+
     # protocol.py
     def hw_reset(self) -> None: ...
 
@@ -54,6 +59,12 @@ class BK7231SerialInterface(BK7231SerialData):
 
     def read(self, count: int = None, until: bytes = None) -> Union[bytes, int]: ...
 
+    def prepare_command(
+        self,
+        packet: Packet,
+        support_optional: bool = False,
+    ) -> bool: ...
+
     def command(
         self,
         packet: Packet,
@@ -61,6 +72,10 @@ class BK7231SerialInterface(BK7231SerialData):
         support_optional: bool = False,
     ): ...
 
+    def command_batch(self, *packets: Packet) -> List[Union[Packet, bool]]: ...
+
+    def read_response(self, packet: Packet) -> Union[Packet, bool]: ...
+
     # cmd_ll_chip.py
     def fix_addr(self, addr: int) -> int: ...
 
@@ -72,7 +87,21 @@ class BK7231SerialInterface(BK7231SerialData):
 
     def read_flash_range_crc(self, start: int, end: int) -> int: ...
 
-    def check_crc(self, start: int, data: bytes) -> None: ...
+    def read_flash_range_crcs(
+        self,
+        start: int,
+        end: int,
+        granularity: int = 0x1000,
+    ) -> List[int]: ...
+
+    def check_crc(self, start: int, data: Union[bytes, memoryview]) -> None: ...
+
+    def check_crc_ranges(
+        self,
+        ranges: List[Tuple[int, Union[bytes, memoryview]]],
+    ) -> None: ...
+
+    def check_crc_value(self, start: int, end: int, calc: int) -> None: ...
 
     @property
     def has_crc_flash_protect_lock(self) -> bool:
@@ -99,6 +128,8 @@ class BK7231SerialInterface(BK7231SerialData):
         crc_check: bool = True,
     ) -> bytes: ...
 
+    def flash_read_4k_multi(self, start: int, count: int) -> List[bytes]: ...
+
     def flash_write_bytes(
         self,
         start: int,
@@ -110,7 +141,7 @@ class BK7231SerialInterface(BK7231SerialData):
     def flash_write_4k(
         self,
         start: int,
-        data: bytes,
+        data: Union[bytes, memoryview],
         crc_check: bool = True,
         dry_run: bool = False,
     ) -> None: ...
@@ -122,6 +153,15 @@ class BK7231SerialInterface(BK7231SerialData):
         dry_run: bool = False,
     ) -> None: ...
 
+    def flash_erase_write_4k(
+        self,
+        start: int,
+        data: Union[bytes, memoryview],
+        crc_check: bool = True,
+        dry_run: bool = False,
+        crc_deferred: bool = False,
+    ) -> None: ...
+
     # cmd_hl_flash.py
     def flash_unprotect(self, mask: int = 0b01111100) -> None: ...
 
@@ -134,6 +174,15 @@ class BK7231SerialInterface(BK7231SerialData):
         crc_check: bool = True,
     ) -> Generator[bytes, None, None]: ...
 
+    def flash_read_verify(self, start: int, chunks: List[bytes]) -> None: ...
+
+    def flash_read_into(
+        self,
+        start: int,
+        buf: memoryview,
+        crc_check: bool = True,
+    ) -> None: ...
+
     def flash_read_bytes(
         self,
         start: int,
@@ -149,4 +198,5 @@ class BK7231SerialInterface(BK7231SerialData):
         crc_check: bool = False,
         really_erase: bool = False,
         dry_run: bool = False,
+        skip_if_match: bool = False,
     ) -> Generator[int, None, None]: ...
@@ -1,15 +1,28 @@
 # Copyright (c) Kuba Szczodrzyński 2022-06-21.
 
-from dataclasses import astuple, dataclass
+import sys
+from dataclasses import dataclass
 from enum import IntEnum
-from struct import calcsize, pack, unpack
-from typing import Dict, List, Type
+from operator import attrgetter
+from struct import Struct
+from typing import Any, Callable, Dict, List, Tuple, Type, Union
+
+if sys.version_info >= (3, 10):
+    from inspect import get_annotations
+else:
+    # older versions always keep the class' own annotations in its __dict__
+    def get_annotations(cls: type) -> dict:
+        return cls.__dict__.get("__annotations__", {})
+
 
 PACKET_CMND_PREAMBLE = b"\x01\xE0\xFC"
 PACKET_CMND_LONG = b"\xFF\xF4"
 PACKET_RESP_PREAMBLE = b"\x04\x0E"
 PACKET_RESP_DATA = b"\x01\xE0\xFC"
 PACKET_RESP_LONG = b"\xF4"
+# (size, code) headers following the preamble
+PACKET_HEADER_SHORT = Struct("<BB")
+PACKET_HEADER_LONG = Struct("<HB")
 
 
 class EraseSize(IntEnum):
@@ -18,6 +31,8 @@ class EraseSize(IntEnum):
 
 
 class Packet:
+    __slots__ = ()
+
     CODE: int
     FORMAT: str
     IS_LONG: bool = False
@@ -27,39 +42,77 @@ class Packet:
     OFFSET_FIELDS: List[str] = None
     HEX_FIELDS: List[str] = None
     DATA_FIELDS: List[str] = None
+    # computed for each subclass
+    STRUCT: Struct  # FORMAT without the trailing '$'
+    HAS_TAIL: bool  # whether the last field takes the remaining data ('$')
+    GET_FIELDS: Callable[["Packet"], tuple]  # shallow replacement for astuple()
+    CMND_PREFIX: bytes  # constant bytes preceding the command header
+    CMND_HEADER: Struct  # command (size, code) header
+    CMND_FRAME: bytes = None  # entire encoded command, if it has no fields
+    REPR_FIELDS: Tuple[Tuple[str, Callable[[Any], str]], ...]  # field formatters
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        cls.HAS_TAIL = cls.FORMAT.endswith("$")
+        cls.STRUCT = Struct(cls.FORMAT[:-1] if cls.HAS_TAIL else cls.FORMAT)
+        # dataclass fields are not processed yet - use the class' own annotations
+        # (not through __dict__, as Python 3.14 evaluates them lazily)
+        names = tuple(get_annotations(cls))
+        if len(names) > 1:
+            get_fields = attrgetter(*names)
+        elif names:
+            get_fields = lambda self, get=attrgetter(*names): (get(self),)
+        else:
+            get_fields = lambda self: ()
+        cls.GET_FIELDS = staticmethod(get_fields)
+        if cls.IS_LONG:
+            cls.CMND_PREFIX = PACKET_CMND_PREAMBLE + PACKET_CMND_LONG
+            cls.CMND_HEADER = PACKET_HEADER_LONG
+        else:
+            cls.CMND_PREFIX = PACKET_CMND_PREAMBLE
+            cls.CMND_HEADER = PACKET_HEADER_SHORT
+        if not names and not cls.FORMAT:
+            cls.CMND_FRAME = cls.CMND_PREFIX + cls.CMND_HEADER.pack(1, cls.CODE)
+        # choose field formatters for __repr__()
+        hex_fields = set(cls.HEX_FIELDS or []) | set(cls.OFFSET_FIELDS or [])
+        data_fields = set(cls.DATA_FIELDS or [])
+        repr_fields = []
+        for name in names:
+            if name in hex_fields:
+                repr_fields.append((name, lambda value: f"0x{value:X}"))
+            elif name in data_fields:
+                repr_fields.append((name, lambda value: f"bytes({len(value)})"))
+            else:
+                repr_fields.append((name, format))
+        cls.REPR_FIELDS = tuple(repr_fields)
 
     def serialize(self) -> bytes:
-        fields = astuple(self)
-        if self.FORMAT.endswith("$"):
-            data = pack(self.FORMAT[:-1], *fields[:-1])
-            data += fields[-1]
-            return data
-        return pack(self.FORMAT, *fields)
+        fields = self.GET_FIELDS(self)
+        if self.HAS_TAIL:
+            return self.STRUCT.pack(*fields[:-1]) + fields[-1]
+        return self.STRUCT.pack(*fields)
+
+    def serialize_head(self) -> bytes:
+        # fixed-size fields only, without copying the trailing data
+        fields = self.GET_FIELDS(self)
+        if self.HAS_TAIL:
+            return self.STRUCT.pack(*fields[:-1])
+        return self.STRUCT.pack(*fields)
 
     @classmethod
     def deserialize(cls, data: bytes) -> "Packet":
-        if cls.FORMAT.endswith("$"):
-            fmt = cls.FORMAT[:-1]
-            size = calcsize(fmt)
-            fields = unpack(fmt, data[:size])
-            fields += (data[size:],)
+        if cls.HAS_TAIL:
+            fields = cls.STRUCT.unpack_from(data)
+            fields += (data[cls.STRUCT.size :],)
         else:
-            fields = unpack(cls.FORMAT, data)
+            fields = cls.STRUCT.unpack(data)
         return cls(*fields)
 
     def __repr__(self) -> str:
-        def repr(field: str) -> str:
-            value = getattr(self, field)
-            if self.HEX_FIELDS and field in self.HEX_FIELDS:
-                return f"{field}=0x{value:X}"
-            if self.OFFSET_FIELDS and field in self.OFFSET_FIELDS:
-                return f"{field}=0x{value:X}"
-            if self.DATA_FIELDS and field in self.DATA_FIELDS:
-                return f"{field}=bytes({len(value)})"
-            return f"{field}={value}"
-
-        fields = getattr(self.__class__, "__dataclass_fields__")
-        return self.__class__.__qualname__ + f"(" + ", ".join(map(repr, fields)) + ")"
+        fields = ", ".join(
+            f"{field}={fmt(getattr(self, field))}" for field, fmt in self.REPR_FIELDS
+        )
+        return f"{self.__class__.__qualname__}({fields})"
 
 
 @dataclass(repr=False)
@@ -67,12 +120,14 @@ class BkLinkCheckCmnd(Packet):
     CODE = 0x00  # CMD_LinkCheck
     FORMAT = ""
     HAS_RESP_OTHER = True
+    __slots__ = ()
 
 
 @dataclass(repr=False)
 class BkLinkCheckResp(Packet):
     CODE = 0x01  # CMD_LinkCheck + 1
     FORMAT = "B"
+    __slots__ = ("value",)
     value: int
 
 
@@ -83,6 +138,7 @@ class BkWriteRegCmnd(Packet):
     HAS_RESP_OTHER = True
     HAS_RESP_SAME = slice(0, 8)
     HEX_FIELDS = ["address", "value"]
+    __slots__ = ("address", "value")
     address: int
     value: int
 
@@ -92,6 +148,7 @@ class BkWriteRegResp(Packet):
     CODE = 0x01  # CMD_WriteReg
     FORMAT = "<II"
     HEX_FIELDS = ["address", "value"]
+    __slots__ = ("address", "value")
     address: int
     value: int
 
@@ -103,6 +160,7 @@ class BkReadRegCmnd(Packet):
     HAS_RESP_OTHER = True
     HAS_RESP_SAME = slice(0, 4)
     HEX_FIELDS = ["address"]
+    __slots__ = ("address",)
     address: int
 
 
@@ -111,6 +169,7 @@ class BkReadRegResp(Packet):
     CODE = 0x03  # CMD_ReadReg
     FORMAT = "<II"
     HEX_FIELDS = ["address", "value"]
+    __slots__ = ("address", "value")
     address: int
     value: int
 
@@ -120,6 +179,7 @@ class BkRebootCmnd(Packet):
     CODE = 0x0E  # CMD_Reboot
     FORMAT = "B"
     HEX_FIELDS = ["value"]
+    __slots__ = ("value",)
     value: int
 
 
@@ -128,6 +188,7 @@ class BkSetBaudRateCmnd(Packet):
     CODE = 0x0F  # CMD_SetBaudRate
     FORMAT = "<IB"
     HAS_RESP_SAME = slice(0, 5)
+    __slots__ = ("baudrate", "delay_ms")
     baudrate: int
     delay_ms: int
 
@@ -138,29 +199,40 @@ class BkCheckCrcCmnd(Packet):
     FORMAT = "<II"
     HAS_RESP_OTHER = True
     OFFSET_FIELDS = ["start", "end"]
+    __slots__ = ("start", "end")
     start: int
     end: int
 
+    def serialize(self) -> bytes:
+        return self.STRUCT.pack(self.start, self.end)
+
 
 @dataclass(repr=False)
 class BkCheckCrcResp(Packet):
     CODE = 0x10  # CMD_CheckCRC
     FORMAT = "<I"
     HEX_FIELDS = ["crc32"]
+    __slots__ = ("crc32",)
     crc32: int
 
+    @classmethod
+    def deserialize(cls, data: bytes) -> "Packet":
+        return cls(*cls.STRUCT.unpack(data))
+
 
 @dataclass(repr=False)
 class BkBootVersionCmnd(Packet):
     CODE = 0x11  # CMD_ReadBootVersion
     FORMAT = ""
     HAS_RESP_OTHER = True
+    __slots__ = ()
 
 
 @dataclass(repr=False)
 class BkBootVersionResp(Packet):
     CODE = 0x11  # CMD_ReadBootVersion
     FORMAT = "$"
+    __slots__ = ("version",)
     version: bytes
 
 
@@ -173,6 +245,7 @@ class BkFlashWriteCmnd(Packet):
     HAS_RESP_SAME = slice(1, 5)
     OFFSET_FIELDS = ["start"]
     LONG_FIELDS = ["data"]
+    __slots__ = ("start", "data")
     start: int
     data: bytes
 
@@ -183,6 +256,7 @@ class BkFlashWriteResp(Packet):
     FORMAT = "<BIB"
     STATUS_FIELDS = ["status"]
     OFFSET_FIELDS = ["start"]
+    __slots__ = ("status", "start", "written")
     status: int
     start: int
     written: int
@@ -197,8 +271,12 @@ class BkFlashWrite4KCmnd(Packet):
     HAS_RESP_SAME = slice(1, 5)
     OFFSET_FIELDS = ["start"]
     DATA_FIELDS = ["data"]
+    __slots__ = ("start", "data")
     start: int
-    data: bytes
+    data: Union[bytes, memoryview]
+
+    def serialize(self) -> bytes:
+        return self.STRUCT.pack(self.start) + self.data
 
 
 @dataclass(repr=False)
@@ -207,9 +285,14 @@ class BkFlashWrite4KResp(Packet):
     FORMAT = "<BI"
     STATUS_FIELDS = ["status"]
     OFFSET_FIELDS = ["start"]
+    __slots__ = ("status", "start")
     status: int
     start: int
 
+    @classmethod
+    def deserialize(cls, data: bytes) -> "Packet":
+        return cls(*cls.STRUCT.unpack(data))
+
 
 @dataclass(repr=False)
 class BkFlashRead4KCmnd(Packet):
@@ -219,8 +302,12 @@ class BkFlashRead4KCmnd(Packet):
     HAS_RESP_OTHER = True
     HAS_RESP_SAME = slice(1, 5)
     OFFSET_FIELDS = ["start"]
+    __slots__ = ("start",)
     start: int
 
+    def serialize(self) -> bytes:
+        return self.STRUCT.pack(self.start)
+
 
 @dataclass(repr=False)
 class BkFlashRead4KResp(Packet):
@@ -229,10 +316,16 @@ class BkFlashRead4KResp(Packet):
     STATUS_FIELDS = ["status"]
     OFFSET_FIELDS = ["start"]
     DATA_FIELDS = ["data"]
+    __slots__ = ("status", "start", "data")
     status: int
     start: int
     data: bytes
 
+    @classmethod
+    def deserialize(cls, data: bytes) -> "Packet":
+        status, start = cls.STRUCT.unpack_from(data)
+        return cls(status, start, data[cls.STRUCT.size :])
+
 
 @dataclass(repr=False)
 class BkFlashReg8ReadCmnd(Packet):
@@ -242,6 +335,7 @@ class BkFlashReg8ReadCmnd(Packet):
     HAS_RESP_OTHER = True
     HAS_RESP_SAME = slice(1, 2)
     HEX_FIELDS = ["cmd"]
+    __slots__ = ("cmd",)
     cmd: int
 
 
@@ -250,6 +344,7 @@ class BkFlashReg8ReadResp(Packet):
     CODE = 0x0C  # CMD_FlashReadSR
     FORMAT = "BBB"
     HEX_FIELDS = ["cmd", "data0"]
+    __slots__ = ("status", "cmd", "data0")
     status: int
     cmd: int
     data0: int
@@ -263,6 +358,7 @@ class BkFlashReg8WriteCmnd(Packet):
     HAS_RESP_OTHER = True
     HAS_RESP_SAME = slice(1, 3)
     HEX_FIELDS = ["cmd", "data"]
+    __slots__ = ("cmd", "data")
     cmd: int
     data: int
 
@@ -272,6 +368,7 @@ class BkFlashReg8WriteResp(Packet):
     CODE = 0x0D  # CMD_FlashWriteSR
     FORMAT = "BBB"
     HEX_FIELDS = ["cmd", "data"]
+    __slots__ = ("status", "cmd", "data")
     status: int
     cmd: int
     data: int
@@ -285,6 +382,7 @@ class BkFlashReg16WriteCmnd(Packet):
     HAS_RESP_OTHER = True
     HAS_RESP_SAME = slice(1, 4)
     HEX_FIELDS = ["cmd", "data"]
+    __slots__ = ("cmd", "data")
     cmd: int
     data: int
 
@@ -294,6 +392,7 @@ class BkFlashReg16WriteResp(Packet):
     CODE = 0x0D  # CMD_FlashWriteSR
     FORMAT = "<BBH"
     HEX_FIELDS = ["cmd", "data"]
+    __slots__ = ("status", "cmd", "data")
     status: int
     cmd: int
     data: int
@@ -306,6 +405,7 @@ class BkFlashReg24ReadCmnd(Packet):
     IS_LONG = True
     HAS_RESP_OTHER = True
     HEX_FIELDS = ["cmd"]
+    __slots__ = ("cmd",)
     cmd: int
 
 
@@ -314,6 +414,7 @@ class BkFlashReg24ReadResp(Packet):
     CODE = 0x0E  # CMD_FlashGetMID
     FORMAT = "<BxBBB"
     HEX_FIELDS = ["data0", "data1", "data2"]
+    __slots__ = ("status", "data0", "data1", "data2")
     status: int
     data0: int
     data1: int
@@ -327,6 +428,7 @@ class BkFlashEraseBlockCmnd(Packet):
     IS_LONG = True
     HAS_RESP_SAME = slice(1, 6)
     OFFSET_FIELDS = ["start"]
+    __slots__ = ("erase_size", "start")
     erase_size: EraseSize
     start: int
 
@@ -1,13 +1,21 @@
 #  Copyright (c) Kuba Szczodrzyński 2024-3-5.
 
-from binascii import crc32
-from io import BytesIO
-from typing import IO, Generator
+from queue import Full, Queue
+from threading import Event, Thread
+from typing import IO, Generator, List
+from zlib import crc32
 
 from .base import BK7231SerialInterface, BkProtocolType, EraseSize
+from .base.data import noop
+from .cmd_ll_flash import CRC32_FF_4K, DATA_FF_4K
+
+DATA_FF_64K = DATA_FF_4K * 16
+CRC32_FF_64K = crc32(DATA_FF_64K)
 
 
 class BK7231SerialCmdHLFlash(BK7231SerialInterface):
+    __slots__ = ()
+
     FLASH_SR_SIZE = {
         b"\x0B\x40\x14": 2,
         b"\x0B\x40\x15": 2,
@@ -62,6 +70,9 @@ class BK7231SerialCmdHLFlash(BK7231SerialInterface):
             raise ValueError(f"Flash ID not known: {flash_id.hex()}")
         sr_size = self.FLASH_SR_SIZE[flash_id]
         sr = self.flash_read_sr(size=sr_size)
+        if not sr & mask:
+            # already unprotected, no need to write and verify
+            return
         sr &= ~mask
         self.flash_write_sr(sr, size=sr_size, mask=mask)
 
@@ -77,19 +88,54 @@ class BK7231SerialCmdHLFlash(BK7231SerialInterface):
                 f"flash memory size (0x{self.flash_size:X})"
             )
 
-        block_count = (length - 1) // 4096 + 1
         block_start = start & ~0xFFF
         start = start & 0xFFF
-        for i in range(block_count):
-            progress = i / block_count * 100.0
-            self.info(f"Reading 4k page at 0x{block_start:06X} ({progress:.2f}%)")
-            chunk = self.flash_read_4k(block_start, crc_check)
-            # cut to the requested start offset and length
-            chunk = chunk[start : start + length]
-            start = 0
-            length -= len(chunk)
-            block_start += 4096
-            yield chunk
+        # include the part of the first block before 'start'
+        block_count = (start + length - 1) // 4096 + 1 if length else 0
+        info = self.info if self.info is not noop else None
+        progress = 0.0
+        progress_step = 16 / block_count * 100.0 if block_count else 0.0
+        # read up to 64K at once, then verify it with a single CRC command
+        for i in range(0, block_count, 16):
+            count = min(16, block_count - i)
+            if info:
+                info(f"Reading {count * 4}k at 0x{block_start:06X} ({progress:.2f}%)")
+            progress += progress_step
+            chunks = self.flash_read_4k_multi(block_start, count)
+            if crc_check:
+                self.flash_read_verify(block_start, chunks)
+            for chunk in chunks:
+                # cut to the requested start offset and length
+                chunk = chunk[start : start + length]
+                start = 0
+                length -= len(chunk)
+                yield chunk
+            block_start += count * 4096
+
+    def flash_read_verify(self, start: int, chunks: List[bytes]) -> None:
+        ranges = [(start + i * 4096, chunk) for i, chunk in enumerate(chunks)]
+        try:
+            self.check_crc_ranges(ranges)
+            return
+        except ValueError as e:
+            self.warn(f"Reading failure @ {hex(start)} ({e}), checking each block")
+        # find the failed blocks and read them again
+        for i, (block_start, chunk) in enumerate(ranges):
+            try:
+                self.check_crc(block_start, chunk)
+            except ValueError:
+                chunks[i] = self.flash_read_4k(block_start, crc_check=True)
+
+    def flash_read_into(
+        self,
+        start: int,
+        buf: memoryview,
+        crc_check: bool = True,
+    ) -> None:
+        pos = 0
+        for chunk in self.flash_read(start, len(buf), crc_check):
+            buf[pos : pos + len(chunk)] = chunk
+            pos += len(chunk)
 
     def flash_read_bytes(
         self,
@@ -97,11 +143,9 @@ class BK7231SerialCmdHLFlash(BK7231SerialInterface):
         length: int,
         crc_check: bool = True,
     ) -> bytes:
-        out = BytesIO()
-        for data in self.flash_read(start, length, crc_check):
-            out.write(data)
-        assert out.tell() == length
-        return out.getvalue()
+        out = bytearray(length)
+        self.flash_read_into(start, memoryview(out), crc_check)
+        return bytes(out)
 
     def program_flash(
         self,
@@ -111,6 +155,7 @@ class BK7231SerialCmdHLFlash(BK7231SerialInterface):
         crc_check: bool = False,
         really_erase: bool = False,
         dry_run: bool = False,
+        skip_if_match: bool = False,
     ) -> Generator[int, None, None]:
         end = start + io_size
         addr = start
@@ -136,8 +181,8 @@ class BK7231SerialCmdHLFlash(BK7231SerialInterface):
             )
 
             # write data in 256-byte chunks
-            sector_end = (addr & ~0xFFF) + 4096
-            while addr & 0xFFF:
+            sector_end = sector_addr + 4096
+            while addr < sector_end:
                 padding_len = addr & 0xFF
                 block = io.read(min(256 - padding_len, sector_end - addr))
                 block_size = len(block)
@@ -146,7 +191,7 @@ class BK7231SerialCmdHLFlash(BK7231SerialInterface):
                     return
                 self.flash_write_bytes(
                     addr - padding_len,
-                    padding_len * b"\xFF" + block,
+                    DATA_FF_4K[:padding_len] + block,
                     crc_check=crc_check,
                     dry_run=dry_run,
                 )
@@ -155,35 +200,172 @@ class BK7231SerialCmdHLFlash(BK7231SerialInterface):
 
         assert (addr & 0xFFF) == 0
 
+        # read (and checksum) the input data in a background thread,
+        # so that it's ready by the time the previous sector is written
+        blocks = Queue(maxsize=16)
+        stop = Event()
+
+        def put_block(item) -> bool:
+            while not stop.is_set():
+                try:
+                    blocks.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def read_blocks():
+            image_crc = 0
+            remaining = end - addr
+            while not stop.is_set():
+                try:
+                    # read 64K at once and split it into sectors
+                    chunk = io.read(min(0x10000, remaining))
+                    remaining -= len(chunk)
+                    # compare against erased sectors (no allocation for full chunks);
+                    # only check each sector if the chunk is not empty as a whole
+                    chunk_empty = chunk == DATA_FF_64K[: len(chunk)]
+                    # compute CRC32 of the entire image and of the chunk,
+                    # as padded when writing; hashing the whole chunk at once
+                    # lets zlib release the GIL
+                    padding = DATA_FF_4K[: -len(chunk) % 4096]
+                    image_crc = crc32(padding, crc32(chunk, image_crc))
+                    if chunk_empty and len(chunk) == 0x10000:
+                        chunk_crcs.append(CRC32_FF_64K)
+                    elif chunk:
+                        chunk_crcs.append(crc32(padding, crc32(chunk)))
+                    # split the chunk without copying the sectors
+                    view = memoryview(chunk)
+                    items = []
+                    for offset in range(0, len(chunk), 4096):
+                        block = view[offset : offset + 4096]
+                        block_size = len(block)
+                        block_empty = chunk_empty or block == DATA_FF_4K[:block_size]
+                        if block_size < 4096:
+                            # pad the last sector once, for both writing and CRC
+                            block = bytes(block) + DATA_FF_4K[block_size:]
+                        # the CRC of an erased sector is known
+                        crc = CRC32_FF_4K if block_empty else crc32(block)
+                        items.append((block, block_size, crc, image_crc, block_empty))
+                    if not chunk:
+                        items.append((chunk, 0, 0, image_crc, True))
+                except Exception as e:
+                    put_block(e)
+                    return
+                for item in items:
+                    if not put_block(item):
+                        return
+                if not chunk:
+                    return
+
+        # remember where the sectors start, in case they need to be rewritten
+        sectors_start = addr
+        io_offset = io.tell() if io.seekable() else None
+        # failed sectors can only be rewritten after the fact if the input
+        # can be read again - otherwise verify (and retry) each sector in place
+        verify_each = crc_check and io_offset is None
+        sector_crcs = []
+        chunk_crcs = []
+        image_crc = 0
+
+        reader = Thread(target=read_blocks, daemon=True)
+        reader.start()
+
+        # look for matching data in 64K chunks first, then in single sectors;
+        # skip the per-sector lookup if every CRC command needs a relink,
+        # since that would cost more than just rewriting the sector
+        padded_end = (end + 0xFFF) & ~0xFFF
+        probe_sectors = not self.has_crc_flash_protect_lock
+        chunk_match = False
+
         # write the rest of data in 4K sectors
-        crc = 0
-        while True:
-            block = io.read(4096)
-            block_size = len(block) if addr < end else 0
-            block_empty = not len(block.strip(b"\xff"))
-            if not block_size:
-                self.info("OK!")
-                return
-            # print progress info
-            progress = 100.0 - (end - addr) / io_size * 100.0
-            if block_empty:
-                self.info(f"Erasing at 0x{addr:X} ({progress:.2f}%)")
-            else:
-                self.info(f"Erasing and writing at 0x{addr:X} ({progress:.2f}%)")
-            # compute CRC32
-            crc = crc32(block, crc)
-            self.flash_erase_block(
-                addr,
-                EraseSize.SECTOR_4K,
-                dry_run=dry_run,
-            )
-            if not block_empty:
-                # skip empty blocks
-                self.flash_write_4k(
-                    addr,
-                    block,
-                    crc_check=crc_check,
-                    dry_run=dry_run,
+        info = self.info if self.info is not noop else None
+        progress = (addr - start) / io_size * 100.0 if io_size else 0.0
+        progress_step = 4096 / io_size * 100.0 if io_size else 0.0
+        try:
+            while True:
+                item = blocks.get()
+                if isinstance(item, Exception):
+                    raise item
+                block, block_size, crc, image_crc, block_empty = item
+                if not block_size or addr >= end:
+                    break
+                sector_crcs.append(crc)
+                # check if the sector already contains the data
+                block_match = False
+                if skip_if_match and not dry_run:
+                    index = (addr - sectors_start) // 4096
+                    if index % 16 == 0:
+                        chunk_end = min(addr + 0x10000, padded_end)
+                        chunk_crc = self.read_flash_range_crc(addr, chunk_end)
+                        chunk_match = chunk_crc == chunk_crcs[index // 16]
+                    if chunk_match:
+                        block_match = True
+                    elif probe_sectors:
+                        block_crc = self.read_flash_range_crc(addr, addr + 4096)
+                        block_match = block_crc == crc
+                # print progress info
+                if info:
+                    if block_match:
+                        info(f"Skipping at 0x{addr:X} ({progress:.2f}%), data matches")
+                    elif block_empty:
+                        info(f"Erasing at 0x{addr:X} ({progress:.2f}%)")
+                    else:
+                        info(f"Erasing and writing at 0x{addr:X} ({progress:.2f}%)")
+                if block_match:
+                    # sector is already up to date
+                    pass
+                elif block_empty:
+                    # skip writing empty blocks
+                    self.flash_erase_block(
+                        addr,
+                        EraseSize.SECTOR_4K,
+                        dry_run=dry_run,
+                    )
+                else:
+                    # sectors are verified all at once below, if possible
+                    self.flash_erase_write_4k(
+                        addr,
+                        block,
+                        crc_check=verify_each,
+                        crc_deferred=crc_check and not verify_each,
+                        dry_run=dry_run,
+                    )
+                yield block_size
+                addr += block_size
+                progress += progress_step
+        finally:
+            stop.set()
+            reader.join()
+
+        if crc_check and not verify_each and not dry_run and sector_crcs:
+            # verify the entire image with a single command,
+            # then find the failed sectors by their own CRC values
+            sectors_end = sectors_start + len(sector_crcs) * 4096
+            self.info("Verifying written data...")
+            chip_crc = self.read_flash_range_crc(sectors_start, sectors_end)
+            if chip_crc != image_crc:
+                # narrow it down to 64K chunks first, then check their sectors
+                chip_crcs = self.read_flash_range_crcs(
+                    sectors_start, sectors_end, granularity=0x10000
                 )
-            yield len(block)
-            addr += block_size
+                sectors = []
+                for i, (chip, calc) in enumerate(zip(chip_crcs, chunk_crcs)):
+                    if chip == calc:
+                        continue
+                    chunk_start = sectors_start + i * 0x10000
+                    chunk_end = min(chunk_start + 0x10000, sectors_end)
+                    sectors += enumerate(
+                        self.read_flash_range_crcs(chunk_start, chunk_end), i * 16
+                    )
+                for i, chip in sectors:
+                    calc = sector_crcs[i]
+                    if chip == calc:
+                        continue
+                    addr = sectors_start + i * 4096
+                    self.warn(f"Verification failure @ {hex(addr)}, rewriting")
+                    io.seek(io_offset + i * 4096)
+                    block = io.read(min(4096, end - addr))
+                    self.flash_erase_write_4k(addr, block, crc_check=True)
+
+        self.info("OK!")
@@ -1,7 +1,7 @@
 #  Copyright (c) Kuba Szczodrzyński 2024-3-5.
 
-from binascii import crc32
-from math import ceil
+from typing import List, Tuple, Union
+from zlib import crc32
 
 from .base import BK7231SerialInterface, BkProtocolType
 from .base.packets import (
@@ -13,15 +13,19 @@ from .base.packets import (
     BkWriteRegCmnd,
 )
 
+REBOOT_CMND = BkRebootCmnd(0xA5)
+
 
 class BK7231SerialCmdLLChip(BK7231SerialInterface):
+    __slots__ = ()
+
     def fix_addr(self, addr: int) -> int:
         if self.flash_size == 0 or not self.boot_protection_bypass:
             return addr
         return addr + self.flash_size
 
     def reboot_chip(self) -> None:
-        command = BkRebootCmnd(0xA5)
+        command = REBOOT_CMND
         self.command(command)
 
     def register_read(self, address: int) -> int:
@@ -40,19 +44,17 @@ class BK7231SerialCmdLLChip(BK7231SerialInterface):
         if start > end:
             raise ValueError("Start must be lesser than end!")
         # print a warning instead of just timeout-ing
+        size = end - start
         timeout_current = self.serial.timeout
-        timeout_minimum = (end - start) / self.crc_speed_bps
-        if timeout_minimum > timeout_current:
+        if size > timeout_current * self.crc_speed_bps:
+            # round up to full seconds
+            timeout = -(-size // self.crc_speed_bps)
             self.warn(
-                "The current command timeout of",
-                timeout_current,
-                "second(s) is too low for reading",
-                end - start,
-                "bytes CRC. Increasing to",
-                ceil(timeout_minimum),
-                "second(s).",
+                f"The current command timeout of {timeout_current} second(s) "
+                f"is too low for reading {size} bytes CRC. "
+                f"Increasing to {timeout} second(s)."
             )
-            self.serial.timeout = ceil(timeout_minimum)
+            self.serial.timeout = timeout
         # fix for BK7231N which also counts the end offset
         if self.protocol_type == BkProtocolType.FULL:
             end -= 1
@@ -66,9 +68,41 @@ class BK7231SerialCmdLLChip(BK7231SerialInterface):
             self.wait_for_link(timeout=self.cmnd_timeout)
         return response.crc32 ^ 0xFFFFFFFF
 
-    def check_crc(self, start: int, data: bytes) -> None:
-        chip = self.read_flash_range_crc(start, start + len(data))
-        calc = crc32(data)
+    def read_flash_range_crcs(
+        self,
+        start: int,
+        end: int,
+        granularity: int = 0x1000,
+    ) -> List[int]:
+        return [
+            self.read_flash_range_crc(offset, min(offset + granularity, end))
+            for offset in range(start, end, granularity)
+        ]
+
+    def check_crc(self, start: int, data: Union[bytes, memoryview]) -> None:
+        self.check_crc_value(start, start + len(data), crc32(data))
+
+    def check_crc_ranges(
+        self,
+        ranges: List[Tuple[int, Union[bytes, memoryview]]],
+    ) -> None:
+        # verify adjacent ranges using a single CRC command
+        run_start = run_end = None
+        calc = 0
+        for start, data in sorted(ranges, key=lambda r: r[0]):
+            if start != run_end:
+                if run_start is not None:
+                    self.check_crc_value(run_start, run_end, calc)
+                run_start = start
+                run_end = start
+                calc = 0
+            calc = crc32(data, calc)
+            run_end += len(data)
+        if run_start is not None:
+            self.check_crc_value(run_start, run_end, calc)
+
+    def check_crc_value(self, start: int, end: int, calc: int) -> None:
+        chip = self.read_flash_range_crc(start, end)
         if chip != calc:
             raise ValueError(
                 f"Chip CRC value {chip:X} does not match calculated CRC value {calc:X}"
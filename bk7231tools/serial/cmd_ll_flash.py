@@ -1,6 +1,7 @@
 #  Copyright (c) Kuba Szczodrzyński 2024-3-5.
 
-from typing import Tuple
+from typing import List, Tuple, Union
+from zlib import crc32
 
 from .base import BK7231SerialInterface
 from .base.packets import (
@@ -21,10 +22,13 @@ from .base.packets import (
     EraseSize,
 )
 
-CRC32_FF_4K = 0xF154670A
+DATA_FF_4K = b"\xFF" * 0x1000
+CRC32_FF_4K = crc32(DATA_FF_4K)  # 0xF154670A
 
 
 class BK7231SerialCmdLLFlash(BK7231SerialInterface):
+    __slots__ = ()
+
     def flash_read_reg8(self, cmd: int) -> int:
         command = BkFlashReg8ReadCmnd(cmd)
         response: BkFlashReg8ReadResp = self.command(command)
@@ -63,14 +67,16 @@ class BK7231SerialCmdLLFlash(BK7231SerialInterface):
             )
 
     def flash_read_id(self, cmd: int = 0x9F) -> dict:
-        self.flash_id = self.flash_id or bytes(self.flash_read_reg24(cmd))
-        self.flash_params = dict(
-            id=self.flash_id,
-            manufacturer_id=self.flash_id[0],
-            chip_id=self.flash_id[1],
-            size_code=self.flash_id[2],
-            size=(1 << self.flash_id[2]),
-        )
+        if self.flash_id is None:
+            self.flash_id = bytes(self.flash_read_reg24(cmd))
+        if self.flash_params is None or self.flash_params["id"] != self.flash_id:
+            self.flash_params = dict(
+                id=self.flash_id,
+                manufacturer_id=self.flash_id[0],
+                chip_id=self.flash_id[1],
+                size_code=self.flash_id[2],
+                size=(1 << self.flash_id[2]),
+            )
         return self.flash_params
 
     def flash_detect_size(self) -> int:
@@ -119,6 +125,37 @@ class BK7231SerialCmdLLFlash(BK7231SerialInterface):
                     raise
         return response.data
 
+    def flash_read_4k_multi(self, start: int, count: int) -> List[bytes]:
+        chunks = []
+        if self.cmnd_pipelining and count > 1:
+            commands = [BkFlashRead4KCmnd(start + i * 4096) for i in range(count)]
+            try:
+                for command in commands:
+                    self.prepare_command(command)
+                # keep the next command queued while receiving the response,
+                # so that the chip doesn't wait for the host between blocks
+                self.write(self.encode(commands[0]))
+                for i, command in enumerate(commands):
+                    if i + 1 < count:
+                        self.write(self.encode(commands[i + 1]))
+                    response: BkFlashRead4KResp = self.read_response(command)
+                    if len(response.data) != 0x1000:
+                        raise ValueError(
+                            f"Invalid data length received: {len(response.data)}"
+                        )
+                    chunks.append(response.data)
+            except ValueError as e:
+                self.warn(
+                    f"Pipelined reading failure @ {hex(start + len(chunks) * 4096)} "
+                    f"({e}), disabling command pipelining"
+                )
+                self.cmnd_pipelining = False
+                self.drain()
+        # read the remaining blocks one by one (with retries)
+        while len(chunks) < count:
+            chunks.append(self.flash_read_4k(start + len(chunks) * 4096, False))
+        return chunks
+
     def flash_write_bytes(
         self,
         start: int,
@@ -142,17 +179,16 @@ class BK7231SerialCmdLLFlash(BK7231SerialInterface):
                     f"can't check CRC"
                 )
                 return
-            if len(data) < 256:
-                # start address aligned, but length is less than 256
-                # add necessary padding
-                # (this is an assumption, that the block was erased prior to writing)
-                data += b"\xFF" * (256 - len(data))
-            self.check_crc(start, data)
+            # start address aligned, but length may be less than 256
+            # add necessary padding, without copying the data
+            # (this is an assumption, that the block was erased prior to writing)
+            calc = crc32(DATA_FF_4K[: 256 - len(data)], crc32(data))
+            self.check_crc_value(start, start + 256, calc)
 
     def flash_write_4k(
         self,
         start: int,
-        data: bytes,
+        data: Union[bytes, memoryview],
         crc_check: bool = True,
         dry_run: bool = False,
     ) -> None:
@@ -161,7 +197,7 @@ class BK7231SerialCmdLLFlash(BK7231SerialInterface):
         if len(data) > 4096:
             raise ValueError(f"Data too long ({len(data)} > 4096)")
         if len(data) < 4096:
-            data += (4096 - len(data)) * b"\xff"
+            data = bytes(data) + DATA_FF_4K[len(data) :]
         if dry_run:
             self.info(f" -> would write {len(data)} bytes to 0x{start:X}")
             return
@@ -250,3 +286,61 @@ class BK7231SerialCmdLLFlash(BK7231SerialInterface):
                 attempt += 1
                 if attempt > self.write_retries:
                     raise
+
+    def flash_erase_write_4k(
+        self,
+        start: int,
+        data: Union[bytes, memoryview],
+        crc_check: bool = True,
+        dry_run: bool = False,
+        crc_deferred: bool = False,
+    ) -> None:
+        if start & 0xFFF:
+            raise ValueError(f"Start address (0x{start:06X}) is not 4k-aligned")
+        if len(data) > 4096:
+            raise ValueError(f"Data too long ({len(data)} > 4096)")
+        if len(data) < 4096:
+            data = bytes(data) + DATA_FF_4K[len(data) :]
+
+        # send both commands in a single write, unless the erase operation
+        # still has to be verified (which needs separate CRC round-trips);
+        # the chip has to buffer the write command while it's still erasing,
+        # so only rely on that if the written data is verified afterwards
+        # (here, or by the caller if crc_deferred is set)
+        if (
+            (crc_check or crc_deferred)
+            and not dry_run
+            and self.cmnd_pipelining
+            and (self.flash_erase_checked or self.has_crc_flash_protect_lock)
+        ):
+            try:
+                self.command_batch(
+                    BkFlashEraseBlockCmnd(EraseSize.SECTOR_4K, start),
+                    BkFlashWrite4KCmnd(start, data),
+                )
+            except ValueError as e:
+                self.warn(
+                    f"Pipelined writing failure @ {hex(start)} ({e}), "
+                    f"disabling command pipelining"
+                )
+                self.cmnd_pipelining = False
+                self.drain()
+            else:
+                try:
+                    if crc_check:
+                        self.check_crc(start, data)
+                    return
+                except ValueError as e:
+                    self.warn(f"Writing 4k failure @ {hex(start)} ({e}), retrying")
+
+        self.flash_erase_block(
+            start,
+            EraseSize.SECTOR_4K,
+            dry_run=dry_run,
+        )
+        self.flash_write_4k(
+            start,
+            data,
+            crc_check=crc_check,
+            dry_run=dry_run,
+        )
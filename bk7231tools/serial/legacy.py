@@ -1,11 +1,11 @@
 #  Copyright (c) Kuba Szczodrzyński 2024-3-5.
 
-from io import BytesIO
-
 from .base import BK7231SerialInterface
 
 
 class BK7231SerialLegacy(BK7231SerialInterface):
+    __slots__ = ()
+
     @property
     def chip_info(self) -> str:
         return (
@@ -24,10 +24,9 @@ class BK7231SerialLegacy(BK7231SerialInterface):
         count: int = 1,
         crc_check: bool = True,
     ) -> bytes:
-        out = BytesIO()
-        for data in self.flash_read(start, count * 4096, crc_check):
-            out.write(data)
-        return out.getvalue()
+        out = bytearray(count * 4096)
+        self.flash_read_into(start, memoryview(out), crc_check)
+        return bytes(out)
 
 
 # legacy compatibility only - do not use!
@@ -1,7 +1,7 @@
 #  Copyright (c) Kuba Szczodrzyński 2024-3-5.
 
-from binascii import crc32
 from time import sleep
+from zlib import crc32
 
 from serial import Timeout
 
@@ -15,8 +15,14 @@ from .base.packets import (
     BkSetBaudRateCmnd,
 )
 
+# argument-less commands are never modified - reuse a single instance
+LINK_CHECK_CMND = BkLinkCheckCmnd()
+BOOT_VERSION_CMND = BkBootVersionCmnd()
+
 
 class BK7231SerialLinking(BK7231SerialInterface):
+    __slots__ = ()
+
     def connect(self):
         # try to communicate
         if not self.wait_for_link(self.link_timeout):
@@ -33,8 +39,8 @@ class BK7231SerialLinking(BK7231SerialInterface):
             pass
         if not self.flash_size and self.flash_params:
             self.flash_size = self.flash_params["size"]
-        if not self.flash_size and self.bootloader_type:
-            self.flash_size = self.bootloader_type.value.flash_size
+        if not self.flash_size and self.bootloader:
+            self.flash_size = self.bootloader.flash_size
         if not self.flash_size:
             self.flash_size = self.flash_detect_size()
             self.flash_size_detected = True
@@ -43,17 +49,23 @@ class BK7231SerialLinking(BK7231SerialInterface):
         if self.serial and not self.serial.closed:
             self.serial.close()
             self.serial = None
+            self.serial_fd = None
 
     def wait_for_link(self, timeout: float) -> bool:
         tm = Timeout(timeout)
         tm_prev = self.serial.timeout
         self.serial.timeout = 0.005
 
-        command = BkLinkCheckCmnd()
+        command = LINK_CHECK_CMND
+        self.prepare_command(command)
+        # the BootROM only listens for a short while after reset,
+        # so keep polling at full rate - but encode the command only once
+        data = self.encode(command)
         connected = False
         while not tm.expired():
             try:
-                response: BkLinkCheckResp = self.command(command)
+                self.write(data)
+                response: BkLinkCheckResp = self.read_response(command)
                 if response and response.value == 0:
                     connected = True
                     break
@@ -77,14 +89,16 @@ class BK7231SerialLinking(BK7231SerialInterface):
     def detect_chip(self) -> None:
         # try bootloader CRC matching first
         # all known protocols support this command
-        crc = self.read_flash_range_crc(0, 256)
+        if self.bootloader_crc is None:
+            self.bootloader_crc = self.read_flash_range_crc(0, 256)
+        crc = self.bootloader_crc
         self.bootloader_type = BkBootloaderType.get_by_crc(crc)
 
         if self.bootloader_type:
             # if bootloader is known, set protocol_type and chip_type
-            self.protocol_type = self.bootloader_type.value.protocol
-            self.chip_type = self.bootloader_type.value.chip
             self.bootloader = self.bootloader_type.value
+            self.protocol_type = self.bootloader.protocol
+            self.chip_type = self.bootloader.chip
         else:
             # if bootloader is not known, try to guess the protocol type
             self.chip_type = None
@@ -93,36 +107,17 @@ class BK7231SerialLinking(BK7231SerialInterface):
                 f"Unknown bootloader CRC - 0x{crc:08X}"
                 f" - please report this on GitHub issues!"
             )
-            # check CRC of app data, which is readable on all protocols
-            check_offset = 0x11000
-            check_length = 256
-            crc = self.read_flash_range_crc(
-                start=check_offset,
-                end=check_offset + check_length,
-            )
-            data = self.flash_read_bytes(
-                start=check_offset,
-                length=check_length + 1,
-                crc_check=False,
-            )
-            # guess the protocol type
-            if crc == crc32(data[0 : check_length + 1]):
-                # BK72xx BootROM protocol - CRC range end-inclusive
-                self.protocol_type = BkProtocolType.FULL
-            elif crc == crc32(data[0 : check_length + 0]):
-                # BK72xx Bootloader protocol - assume minimal command support
-                self.protocol_type = BkProtocolType.BASIC_BEKEN
-            else:
-                # CRC does not match - fail
-                raise ValueError("CRC mismatch while checking chip type!")
+            if self.protocol_type is None:
+                # guess the protocol type - only once, keep it for reconnects
+                self.protocol_type = self.detect_protocol()
 
         if self.check_protocol(BkReadRegCmnd):
             # read BK72xx BootROM SCTRL_CHIP_ID
             self.bk_chip_id = self.register_read(0x800000)
             # match the chip by ID
-            if any(c.value == self.bk_chip_id for c in BkChipType):
+            try:
                 self.chip_type = BkChipType(self.bk_chip_id)
-            else:
+            except ValueError:
                 self.warn(
                     f"Unknown SCTRL_CHIP_ID - {hex(self.bk_chip_id)}"
                     f" - please report this on GitHub issues!"
@@ -130,7 +125,7 @@ class BK7231SerialLinking(BK7231SerialInterface):
 
         if self.check_protocol(BkBootVersionCmnd):
             # read BK7231T boot version
-            command = BkBootVersionCmnd()
+            command = BOOT_VERSION_CMND
             response: BkBootVersionResp = self.command(command)
             if response.version != b"\x07":
                 self.bk_boot_version = response.version.decode().strip("\x00\x20")
@@ -143,3 +138,28 @@ class BK7231SerialLinking(BK7231SerialInterface):
             f"chip ID: {self.bk_chip_id and hex(self.bk_chip_id)}, "
             f"boot version: {self.bk_boot_version}"
         )
+
+    def detect_protocol(self) -> BkProtocolType:
+        # check CRC of app data, which is readable on all protocols
+        check_offset = 0x11000
+        check_length = 256
+        crc = self.read_flash_range_crc(
+            start=check_offset,
+            end=check_offset + check_length,
+        )
+        data = self.flash_read_bytes(
+            start=check_offset,
+            length=check_length + 1,
+            crc_check=False,
+        )
+        crc_exclusive = crc32(data[0 : check_length + 0])
+        crc_inclusive = crc32(data[check_length : check_length + 1], crc_exclusive)
+        if crc == crc_inclusive:
+            # BK72xx BootROM protocol - CRC range end-inclusive
+            return BkProtocolType.FULL
+        elif crc == crc_exclusive:
+            # BK72xx Bootloader protocol - assume minimal command support
+            return BkProtocolType.BASIC_BEKEN
+        else:
+            # CRC does not match - fail
+            raise ValueError("CRC mismatch while checking chip type!")
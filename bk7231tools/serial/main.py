@@ -1,5 +1,7 @@
 #  Copyright (c) Kuba Szczodrzyński 2024-3-5.
 
+import io
+
 from serial import Serial
 
 from .cmd_hl_flash import BK7231SerialCmdHLFlash
@@ -18,6 +20,8 @@ class BK7231Serial(
     BK7231SerialCmdLLFlash,
     BK7231SerialCmdHLFlash,
 ):
+    __slots__ = ()
+
     def __init__(
         self,
         port: str,
@@ -27,14 +31,21 @@ class BK7231Serial(
         link_baudrate: int = 115200,
         **kwargs,
     ) -> None:
+        super().__init__()
         self.serial = Serial(
             port=port,
             baudrate=link_baudrate,
             timeout=cmnd_timeout,
         )
+        try:
+            # Only pyserial POSIX implementation has a usable file descriptor,
+            # the Windows one raises io.UnsupportedOperation
+            self.serial_fd = self.serial.fileno()
+        except (io.UnsupportedOperation, OSError):
+            self.serial_fd = None
         if hasattr(self.serial, "set_buffer_size"):
             # This method doesn't exist in pyserial POSIX implementation
-            self.serial.set_buffer_size(rx_size=8192)
+            self.serial.set_buffer_size(rx_size=0x10000)
         self.baudrate = baudrate
         self.link_timeout = link_timeout
         self.cmnd_timeout = cmnd_timeout
@@ -1,16 +1,21 @@
 #  Copyright (c) Kuba Szczodrzyński 2024-3-5.
 
+import os
+import select
 import struct
 import sys
-from struct import pack, unpack
 from textwrap import shorten
 from time import sleep
-from typing import Callable, Type, Union
+from typing import Callable, List, Type, Union
+
+from serial import Timeout
 
 from .base import BK7231SerialInterface, Packet
+from .base.data import noop
 from .base.packets import (
     PACKET_CMND_LONG,
     PACKET_CMND_PREAMBLE,
+    PACKET_HEADER_LONG,
     PACKET_RESP_DATA,
     PACKET_RESP_LONG,
     PACKET_RESP_PREAMBLE,
@@ -20,8 +25,16 @@ from .legacy import CHIP_BY_CRC
 
 __compat__ = CHIP_BY_CRC
 
+# choose the hex dump format once, instead of checking the version for every packet
+if sys.version_info >= (3, 8):
+    hex_dump = lambda data: data.hex(" ")
+else:
+    hex_dump = lambda data: data.hex()
+
 
 class BK7231SerialProtocol(BK7231SerialInterface):
+    __slots__ = ()
+
     def hw_reset(self) -> None:
         # reset the chip using RTS and DTR lines
         self.serial.rts = True
@@ -32,6 +45,7 @@ class BK7231SerialProtocol(BK7231SerialInterface):
         self.serial.rts = False
 
     def drain(self) -> None:
+        self.rx_buffer.clear()
         tm_prev = self.serial.timeout
         self.serial.timeout = 0.001
         while self.serial.read(1 * 1024) != b"":
@@ -56,60 +70,79 @@ class BK7231SerialProtocol(BK7231SerialInterface):
     ) -> bool:
         if self.protocol_type is None:
             return True
-        if isinstance(packet, int):
-            pair = (packet, is_long)
-        else:
-            pair = (packet.CODE, packet.IS_LONG)
-        if pair not in self.protocol_type.value:
-            return False
-        return True
+        if not isinstance(packet, int):
+            packet, is_long = packet.CODE, packet.IS_LONG
+        if is_long:
+            return packet in self.protocol_type.long_cmds
+        return packet in self.protocol_type.short_cmds
 
     @staticmethod
     def encode(packet: Packet) -> bytes:
-        out = PACKET_CMND_PREAMBLE
+        if packet.CMND_FRAME:
+            return packet.CMND_FRAME
         data = packet.serialize()
         size = len(data) + 1
-        if size >= 0xFF or packet.IS_LONG:
-            out += PACKET_CMND_LONG
-            out += pack("<H", size)
-        else:
-            out += pack("B", size)
-        out += pack("B", packet.CODE)
-        out += data
-        return out
+        if size >= 0xFF and not packet.IS_LONG:
+            # short command with too much data - send as long command
+            header = PACKET_HEADER_LONG.pack(size, packet.CODE)
+            return b"".join((PACKET_CMND_PREAMBLE, PACKET_CMND_LONG, header, data))
+        header = packet.CMND_HEADER.pack(size, packet.CODE)
+        # join the parts at once, copying the payload only once
+        return b"".join((packet.CMND_PREFIX, header, data))
 
     def write(self, data: bytes) -> None:
-        if data:
-            if sys.version_info >= (3, 8):
-                self.verbose(f"<- TX: {data.hex(' ')}")
-            else:
-                self.verbose(f"<- TX: {data.hex()}")
-        self.serial.write(data)
-        self.serial.flush()
+        # skip formatting the hex dump if it's going to be discarded anyway
+        if data and self.verbose is not noop:
+            self.verbose(f"<- TX: {hex_dump(data)}")
+        if self.serial_fd is None:
+            self.serial.write(data)
+        else:
+            # write to the OS handle directly, skipping pyserial's per-call
+            # select() and data copies; the port is opened in non-blocking mode
+            view = memoryview(data)
+            while view:
+                try:
+                    view = view[os.write(self.serial_fd, view) :]
+                except BlockingIOError:
+                    select.select([], [self.serial_fd], [])
 
     def read(self, count: int = None, until: bytes = None) -> Union[bytes, int]:
-        if count:
-            data = self.serial.read(count)
-        elif until:
-            data = self.serial.read_until(until)
+        # read everything that's already available in one call,
+        # instead of letting pyserial read the header byte-by-byte
+        buf = self.rx_buffer
+        if until and not count:
+            tm = Timeout(self.serial.timeout)
+            pos = 0
+            while True:
+                end = buf.find(until, pos)
+                if end != -1:
+                    end += len(until)
+                    break
+                pos = max(len(buf) - len(until) + 1, 0)
+                data = self.serial.read(max(self.serial.in_waiting, 1))
+                buf += data
+                if not data or tm.expired():
+                    end = buf.find(until, pos)
+                    end = len(buf) if end == -1 else end + len(until)
+                    break
         else:
-            data = self.serial.read(1)
-
-        if data:
-            if sys.version_info >= (3, 8):
-                self.verbose(f"-> RX: {data.hex(' ')}")
-            else:
-                self.verbose(f"-> RX: {data.hex()}")
+            end = count or 1
+            if len(buf) < end:
+                buf += self.serial.read(max(end - len(buf), self.serial.in_waiting))
+        data = bytes(buf[:end])
+        del buf[:end]
+
+        if data and self.verbose is not noop:
+            self.verbose(f"-> RX: {hex_dump(data)}")
         if not count and not until:
             return data[0] if data else 0
         return data
 
-    def command(
+    def prepare_command(
         self,
         packet: Packet,
-        after_send: Callable = None,
         support_optional: bool = False,
-    ) -> Union[Packet, bool]:
+    ) -> bool:
         if support_optional:
             if not self.check_protocol(packet):
                 return False
@@ -117,18 +150,41 @@ class BK7231SerialProtocol(BK7231SerialInterface):
             self.require_protocol(packet)
 
         # correct flash offsets to bypass bootloader protection
-        if packet.OFFSET_FIELDS and self.boot_protection_bypass:
+        # (same as fix_addr(), inlined as it runs for every flash command)
+        if packet.OFFSET_FIELDS and self.boot_protection_bypass and self.flash_size:
+            flash_size = self.flash_size
             for field in packet.OFFSET_FIELDS:
-                offset = getattr(packet, field)
-                offset = self.fix_addr(offset)
-                setattr(packet, field, offset)
+                setattr(packet, field, getattr(packet, field) + flash_size)
 
-        self.debug("<- TX:", shorten(str(packet), 100))
+        if self.debug is not noop:
+            self.debug("<- TX:", shorten(str(packet), 100))
+        return True
+
+    def command(
+        self,
+        packet: Packet,
+        after_send: Callable = None,
+        support_optional: bool = False,
+    ) -> Union[Packet, bool]:
+        if not self.prepare_command(packet, support_optional):
+            return False
 
         self.write(self.encode(packet))
         if after_send:
+            # make sure the command was sent, before e.g. changing the baud rate
+            self.serial.flush()
             after_send()
 
+        return self.read_response(packet)
+
+    def command_batch(self, *packets: Packet) -> List[Union[Packet, bool]]:
+        for packet in packets:
+            self.prepare_command(packet)
+        # send all commands at once, then collect the responses in order
+        self.write(b"".join(self.encode(packet) for packet in packets))
+        return [self.read_response(packet) for packet in packets]
+
+    def read_response(self, packet: Packet) -> Union[Packet, bool]:
         if not packet.HAS_RESP_OTHER and not packet.HAS_RESP_SAME:
             return True
 
@@ -156,7 +212,7 @@ class BK7231SerialProtocol(BK7231SerialInterface):
                 if PACKET_RESP_LONG != self.read(until=PACKET_RESP_LONG):
                     # Invalid packet, so continue reading until a new valid packet is found
                     continue
-                (size, code) = unpack("<HB", self.read(count=3))
+                (size, code) = PACKET_HEADER_LONG.unpack(self.read(count=3))
                 size -= 1  # code
             else:
                 code = self.read()
@@ -171,23 +227,23 @@ class BK7231SerialProtocol(BK7231SerialInterface):
             raise ValueError(f"Incomplete response read: {len(response)} != {size}")
 
         if packet.HAS_RESP_SAME:
-            command = packet.serialize()
+            # the echoed part never covers the trailing data
+            command = packet.serialize_head()
             part = packet.HAS_RESP_SAME
             check_len = part.stop - part.start
             if response[part] != command[:check_len]:
                 raise ValueError("Invalid response data payload")
-            self.debug(f"-> RX ({size}): Response check OK")
+            if self.debug is not noop:
+                self.debug(f"-> RX ({size}): Response check OK")
 
         if packet.HAS_RESP_OTHER:
             try:
                 response = cls.deserialize(response)
             except struct.error:
-                if sys.version_info >= (3, 8):
-                    resp = response.hex(" ", -1)
-                else:
-                    resp = response.hex()
+                resp = hex_dump(response)
                 raise ValueError(f"Couldn't deserialize response: {resp}")
-            self.debug(f"-> RX ({size}):", shorten(str(response), 100))
+            if self.debug is not noop:
+                self.debug(f"-> RX ({size}):", shorten(str(response), 100))
             # check response status code, if available
             if response.STATUS_FIELDS:
                 for field in response.STATUS_FIELDS: